@@ -2,10 +2,12 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 
-from dashboard_helper import (get_combined_data,
+from dashboard_helper import (get_daily_totals_df,
+                              get_total_revenue_per_truck,
                               get_cumulative_totals_df,
+                              downsample_cumulative_totals_df,
                               get_best_performing_truck,
                               get_worst_performing_truck,
                               get_average_truck_revenue,
@@ -14,64 +16,93 @@ from dashboard_helper import (get_combined_data,
                               get_average_transaction_amounts)
 
 
-def show_cumulative_totals_line_chart(data: pd.DataFrame, selected_trucks: list) -> None:
-    """ Line chart showing cumulative total revenue over time for each truck """
+@st.cache_data(ttl=300)
+def build_cumulative_totals_line_chart() -> go.Figure:
+    """ Build the cumulative total revenue line chart with a trace for every truck.
+    Cached so filter changes reuse the figure instead of rebuilding it """
+
+    cumulative_totals_df = downsample_cumulative_totals_df(
+        get_cumulative_totals_df(get_daily_totals_df()))
 
-    cumulative_totals_df = get_cumulative_totals_df(data)
-    cumulative_totals_df = cumulative_totals_df[
-        cumulative_totals_df['truck_name'].isin(selected_trucks)]
-    cumulative_chart = px.line(cumulative_totals_df,
-                               title="Cumulative Total Revenue by Truck Over Time",
-                               x='date',
-                               y='cumulative_total_pounds',
-                               color='truck_name',
-                               labels={'truck_name': 'Truck Name',
-                                       'date': 'Date',
-                                       'cumulative_total_pounds': 'Cumulative Total Revenue'
-                                       }
-                               )
+    # One WebGL trace per truck, named after the truck so it can be toggled
+    cumulative_chart = go.Figure()
+    for truck_name, truck_df in cumulative_totals_df.groupby('truck_name', observed=True):
+        cumulative_chart.add_trace(go.Scattergl(x=truck_df['date'],
+                                                y=truck_df['cumulative_total_pounds'],
+                                                name=truck_name,
+                                                mode='lines'))
+
+    cumulative_chart.update_layout(title="Cumulative Total Revenue by Truck Over Time",
+                                   xaxis_title='Date',
+                                   yaxis_title='Cumulative Total Revenue',
+                                   legend_title_text='Truck Name')
 
     cumulative_chart.update_yaxes(tickformat=",", tickprefix="£")
-    st.plotly_chart(cumulative_chart)
 
+    return cumulative_chart
 
-def show_average_revenue_line_chart(data: pd.DataFrame, selected_trucks: list) -> None:
-    """ Line chart showing average transaction amount by hour for each truck """
 
-    transaction_df = get_average_transaction_amounts(data)
-    transaction_df = transaction_df[transaction_df['truck_name'].isin(
-        selected_trucks)]
-    transaction_chart = px.line(transaction_df,
-                                title="Average Transaction Size by Truck per Hour",
-                                x='hour_of_day',
-                                y='average_transaction_amount',
-                                color='truck_name',
-                                labels={'truck_name': 'Truck Name',
-                                        'hour_of_day': 'Hour of Day',
-                                        'average_transaction_amount': 'Average Transaction Amount'
-                                        }
-                                )
+def show_cumulative_totals_line_chart(selected_trucks: set) -> None:
+    """ Line chart showing cumulative total revenue over time for each truck """
+
+    cumulative_chart = build_cumulative_totals_line_chart()
+
+    # Hide the unselected trucks' traces rather than filtering and rebuilding
+    cumulative_chart.for_each_trace(
+        lambda trace: trace.update(visible=trace.name in selected_trucks))
+    st.plotly_chart(cumulative_chart, key='cumulative_totals_chart')
+
+
+@st.cache_data(ttl=300)
+def build_average_revenue_line_chart() -> go.Figure:
+    """ Build the average transaction amount line chart with a trace for every truck.
+    Cached so filter changes reuse the figure instead of rebuilding it """
+
+    transaction_df = get_average_transaction_amounts()
+
+    # One WebGL trace per truck, named after the truck so it can be toggled
+    transaction_chart = go.Figure()
+    for truck_name, truck_df in transaction_df.groupby('truck_name', observed=True):
+        transaction_chart.add_trace(go.Scattergl(x=truck_df['hour_of_day'],
+                                                 y=truck_df['average_transaction_amount'],
+                                                 name=truck_name,
+                                                 mode='lines'))
+
+    transaction_chart.update_layout(title="Average Transaction Size by Truck per Hour",
+                                    xaxis_title='Hour of Day',
+                                    yaxis_title='Average Transaction Amount',
+                                    legend_title_text='Truck Name')
 
     transaction_chart.update_yaxes(tickformat=",", tickprefix="£")
-    st.plotly_chart(transaction_chart)
+
+    return transaction_chart
+
+
+def show_average_revenue_line_chart(selected_trucks: set) -> None:
+    """ Line chart showing average transaction amount by hour for each truck """
+
+    transaction_chart = build_average_revenue_line_chart()
+
+    # Hide the unselected trucks' traces rather than filtering and rebuilding
+    transaction_chart.for_each_trace(
+        lambda trace: trace.update(visible=trace.name in selected_trucks))
+    st.plotly_chart(transaction_chart, key='average_revenue_chart')
 
 
-def show_kpi_metrics(data: pd.DataFrame) -> None:
+def show_kpi_metrics(truck_totals: pd.Series) -> None:
     """ KPI Metrics showing the best and worst performing trucks, their total revenue,
     and how this compares to the average total revenue across all trucks
     """
 
     st.subheader("Total Revenue Metrics")
 
-    average_truck_revenue = get_average_truck_revenue(data)
+    average_truck_revenue = get_average_truck_revenue(truck_totals)
 
-    best_truck = get_best_performing_truck(data)
-    best_truck_name = best_truck['truck_name']
-    best_truck_revenue = best_truck['total_pounds']
+    best_truck_name = get_best_performing_truck(truck_totals)
+    best_truck_revenue = truck_totals[best_truck_name]
 
-    worst_truck = get_worst_performing_truck(data)
-    worst_truck_name = worst_truck['truck_name']
-    worst_truck_revenue = worst_truck['total_pounds']
+    worst_truck_name = get_worst_performing_truck(truck_totals)
+    worst_truck_revenue = truck_totals[worst_truck_name]
 
     col_1, col_2 = st.columns(2)
     with col_1:
@@ -89,46 +120,59 @@ def show_kpi_metrics(data: pd.DataFrame) -> None:
         )
 
 
-def show_payment_method_distribution_chart(data: pd.DataFrame, selected_trucks: list) -> None:
+def show_payment_method_distribution_chart(selected_trucks: set) -> None:
     """ Bar chart showing the distribution of payment methods used across each truck """
 
-    payment_method_df = get_payment_method_distribution_df(data)
+    payment_method_df = get_payment_method_distribution_df()
     payment_method_df = payment_method_df[payment_method_df['truck_name'].isin(
         selected_trucks)]
-    payment_method_chart = px.bar(payment_method_df,
-                                  title="Distribution of Payment Methods by Truck",
-                                  x='truck_name',
-                                  y='count',
-                                  color='payment_method',
-                                  labels={'truck_name': 'Truck Name',
-                                          'count': 'Number of Transactions',
-                                          'payment_method': 'Payment Method'
-                                          }
-                                  )
-    st.plotly_chart(payment_method_chart)
 
+    # One stacked bar trace per payment method
+    payment_method_chart = go.Figure()
+    for payment_method, method_df in payment_method_df.groupby('payment_method', observed=True):
+        payment_method_chart.add_trace(go.Bar(x=method_df['truck_name'].astype(str),
+                                              y=method_df['count'],
+                                              name=payment_method))
 
-def main():
-    st.title("🚚 T3 Truck Performance Dashboard")
+    payment_method_chart.update_layout(title="Distribution of Payment Methods by Truck",
+                                       barmode='relative',
+                                       xaxis_title='Truck Name',
+                                       yaxis_title='Number of Transactions',
+                                       legend_title_text='Payment Method')
+    st.plotly_chart(payment_method_chart, key='payment_method_chart')
 
-    # Load all data
-    data = get_combined_data()
 
-    with st.sidebar:
-        st.header("Filters")
-        selected_trucks = st.multiselect(
-            label="Total Revenue Over Time by Truck - Select Trucks",
-            options=data['truck_name'].unique(),
-            default=data['truck_name'].unique()
-        )
+@st.fragment
+def show_truck_charts(truck_names: list) -> None:
+    """ Truck filter and the charts it controls. Runs as a fragment, so changing
+    the selection only reruns this section rather than the whole dashboard """
+
+    st.subheader("Filters")
+    selected_trucks = st.multiselect(
+        label="Total Revenue Over Time by Truck - Select Trucks",
+        options=truck_names,
+        default=truck_names
+    )
 
-    show_kpi_metrics(data)
+    # Build the selection once, shared by every chart as an O(1) membership check
+    selected_trucks = set(selected_trucks)
+
+    show_cumulative_totals_line_chart(selected_trucks)
+
+    show_payment_method_distribution_chart(selected_trucks)
+
+    show_average_revenue_line_chart(selected_trucks)
+
+
+def main():
+    st.title("🚚 T3 Truck Performance Dashboard")
 
-    show_cumulative_totals_line_chart(data, selected_trucks)
+    # Load the total revenue per truck, shared by the filters and KPI metrics
+    truck_totals = get_total_revenue_per_truck(get_daily_totals_df())
 
-    show_payment_method_distribution_chart(data, selected_trucks)
+    show_kpi_metrics(truck_totals)
 
-    show_average_revenue_line_chart(data, selected_trucks)
+    show_truck_charts(truck_totals.index.tolist())
 
 
 if __name__ == "__main__":
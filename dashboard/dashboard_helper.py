@@ -2,20 +2,32 @@
 
 """ Helper functions for the Streamlit dashboard """
 
+import uuid
+
 import awswrangler as wr
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 
 def get_athena_query(query: str) -> pd.DataFrame:
-    """ Execute an Athena query and return the results as a pandas DataFrame """
+    """ Execute an Athena query and return the results as a pandas DataFrame.
+    Results are UNLOADed to S3 as Parquet and read in parallel, rather than
+    paginated through the GetQueryResults API as CSV """
 
     DB_PATH = 'c20-muarij-t3-glue-db'
+    UNLOAD_S3_PATH = 's3://c20-muarij-t3-data-lake/athena_output/unload/'
 
+    # UNLOAD requires an empty destination, so give each query its own prefix,
+    # and delete the Parquet files once they are read so the prefixes don't pile up
     df = wr.athena.read_sql_query(
         sql=query,
         database=DB_PATH,
         ctas_approach=False,
+        unload_approach=True,
+        s3_output=f"{UNLOAD_S3_PATH}{uuid.uuid4().hex}/",
+        keep_files=False,
+        use_threads=True,
         workgroup="c20-muarij-t3-athena-workgroup"
     )
 
@@ -23,88 +35,172 @@ def get_athena_query(query: str) -> pd.DataFrame:
 
 
 @st.cache_data(ttl=300)
-def get_combined_data() -> pd.DataFrame:
-    """ Get the combined data from S3 as a pandas DataFrame using awswrangler """
+def get_daily_totals_df() -> pd.DataFrame:
+    """ Get the total revenue per truck per day from the pre-aggregated
+    truck_daily_totals table, maintained by the pipelines """
 
     sql_query = """
     SELECT
-        transaction_id, 
-        dt.truck_name, 
-        dpm.payment_method, 
-        total/100 AS total_pounds, 
-        at, 
-        has_card_reader,
-        fsa_rating
-    FROM transaction_table AS ft
-    JOIN payment_table AS dpm
-        ON ft.payment_method_id = dpm.payment_method_id 
-    JOIN truck_table AS dt
-        ON ft.truck_id = dt.truck_id
+        truck_name,
+        "date",
+        total_pounds
+    FROM truck_daily_totals
     """
 
     df = get_athena_query(sql_query)
 
+    # Group and sort downstream on integer codes instead of strings
+    df['truck_name'] = df['truck_name'].astype('category')
+
+    # Narrow dtypes halve the cached frame; day precision needs only seconds
+    df['date'] = pd.to_datetime(df['date']).astype('datetime64[s]')
+    df['total_pounds'] = df['total_pounds'].astype('float32')
+
     return df
 
 
+@st.cache_data(ttl=300)
+def get_total_revenue_per_truck(df: pd.DataFrame) -> pd.Series:
+    """ Get the total revenue per truck from the daily totals per truck,
+    as a Series indexed by truck name. Computed once and shared by the KPI helpers """
+
+    # Accumulate in float64, as float32 cannot hold pence at fleet-total scale
+    truck_totals = df['total_pounds'].astype('float64').groupby(
+        df['truck_name'], sort=False, observed=True).sum()
+
+    return truck_totals
+
+
+@st.cache_data(ttl=300)
 def get_cumulative_totals_df(df: pd.DataFrame) -> pd.DataFrame:
-    """ Get cumulative totals of revenue over time for each truck"""
+    """ Get cumulative totals of revenue over time for each truck
+    from the daily totals per truck """
+
+    # Sort by truck then date so each truck's days form one contiguous block
+    daily_totals = df.sort_values(['truck_name', 'date'], ignore_index=True)
+
+    # A single running total over all rows, reset at each truck boundary by
+    # subtracting the running total reached before that truck's first row
+    totals = daily_totals['total_pounds'].to_numpy(dtype='float64')
+    running_total = totals.cumsum()
+    truck_starts = np.flatnonzero(
+        daily_totals['truck_name'].ne(daily_totals['truck_name'].shift()).to_numpy())
+    block_lengths = np.diff(np.append(truck_starts, len(totals)))
+    offsets = np.repeat(
+        running_total[truck_starts] - totals[truck_starts], block_lengths)
+
+    daily_totals['cumulative_total_pounds'] = running_total - offsets
+
+    # Drop the daily column in place rather than copying the frame to select the rest
+    del daily_totals['total_pounds']
+
+    return daily_totals
+
+
+def get_lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """ Get the indices of the n_out points that best preserve the visual shape
+    of a series, using Largest-Triangle-Three-Buckets downsampling """
+
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept, the rest are split into buckets
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    bucket_edges = np.append(bucket_edges, n)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
 
-    df['date'] = pd.to_datetime(df['at']).dt.date
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_end = bucket_edges[i + 2]
 
-    # Group by truck and date, sum the totals
-    daily_totals = df.groupby(['truck_name', 'date'])[
-        'total_pounds'].sum().reset_index()
+        # Pick the point forming the largest triangle with the previously kept
+        # point and the average of the next bucket
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
 
-    # Calculate cumulative sum for each truck
-    # Sort by date first, then use groupby with cumsum()
-    daily_totals = daily_totals.sort_values('date')
-    daily_totals['cumulative_total_pounds'] = daily_totals.groupby('truck_name')[
-        'total_pounds'].cumsum()
+        previous = start + areas.argmax()
+        indices[i + 1] = previous
 
-    daily_totals_cleaned = daily_totals[["truck_name", "date",
-                                        "cumulative_total_pounds"]]
+    return indices
 
-    return daily_totals_cleaned
 
+def downsample_cumulative_totals_df(df: pd.DataFrame,
+                                    max_points_per_truck: int = 1500) -> pd.DataFrame:
+    """ Downsample each truck's cumulative totals with LTTB so the line chart
+    ships at most max_points_per_truck points per truck to the browser """
 
-def get_payment_method_distribution_df(df: pd.DataFrame) -> pd.DataFrame:
-    """ Get the distribution of payment methods for each truck """
+    dates = pd.to_datetime(df['date']).to_numpy().astype('int64').astype(float)
+    cumulative_totals = df['cumulative_total_pounds'].to_numpy()
 
-    payment_distribution_df = df.groupby(['truck_name', 'payment_method'])[
-        'transaction_id'].count().reset_index()
-    payment_distribution_df = payment_distribution_df.rename(
-        columns={'transaction_id': 'count'})
+    kept_rows = []
+    for truck_rows in df.groupby('truck_name', sort=False, observed=True).indices.values():
+        kept = get_lttb_indices(dates[truck_rows], cumulative_totals[truck_rows],
+                                max_points_per_truck)
+        kept_rows.append(truck_rows[kept])
+
+    kept_rows = np.concatenate(kept_rows) if kept_rows else np.arange(0)
+
+    # Nothing was dropped, so hand back the frame itself instead of a copy
+    if len(kept_rows) == len(df):
+        return df
+
+    downsampled_df = df.iloc[np.sort(kept_rows)]
+
+    return downsampled_df
+
+
+@st.cache_data(ttl=300)
+def get_payment_method_distribution_df() -> pd.DataFrame:
+    """ Get the distribution of payment methods for each truck, counted in Athena """
+
+    sql_query = """
+    SELECT
+        truck_name,
+        payment_method,
+        COUNT(*) AS "count"
+    FROM transaction_table
+    GROUP BY 1, 2
+    """
+
+    payment_distribution_df = get_athena_query(sql_query)
+
+    # Convert only the key columns rather than copying the whole frame with astype
+    payment_distribution_df['truck_name'] = payment_distribution_df['truck_name'].astype(
+        'category')
+    payment_distribution_df['payment_method'] = payment_distribution_df['payment_method'].astype(
+        'category')
+    payment_distribution_df['count'] = payment_distribution_df['count'].astype('int32')
 
     return payment_distribution_df
 
 
-def get_best_performing_truck(df: pd.DataFrame) -> pd.DataFrame:
-    """ Get the best performing truck based on total revenue """
+def get_best_performing_truck(truck_totals: pd.Series) -> str:
+    """ Get the name of the best performing truck based on total revenue """
 
-    total_revenue = df.groupby('truck_name')[
-        'total_pounds'].sum().reset_index()
-    best_truck = total_revenue.loc[total_revenue['total_pounds'].idxmax()]
+    best_truck = truck_totals.idxmax()
 
     return best_truck
 
 
-def get_worst_performing_truck(df: pd.DataFrame) -> pd.DataFrame:
-    """ Get the worst performing truck based on total revenue """
+def get_worst_performing_truck(truck_totals: pd.Series) -> str:
+    """ Get the name of the worst performing truck based on total revenue """
 
-    total_revenue = df.groupby('truck_name')[
-        'total_pounds'].sum().reset_index()
-    worst_truck = total_revenue.loc[total_revenue['total_pounds'].idxmin()]
+    worst_truck = truck_totals.idxmin()
 
     return worst_truck
 
 
-def get_average_truck_revenue(df: pd.DataFrame) -> float:
+def get_average_truck_revenue(truck_totals: pd.Series) -> float:
     """ Get the average total revenue across all trucks """
 
-    total_revenue = df.groupby('truck_name')[
-        'total_pounds'].sum().reset_index()
-    average_revenue = total_revenue['total_pounds'].mean()
+    average_revenue = truck_totals.mean()
 
     return average_revenue
 
@@ -119,18 +215,28 @@ def get_percentage_difference(value_1: float, value_2: float) -> float:
     return percentage_diff
 
 
-def get_average_transaction_amounts(df: pd.DataFrame) -> pd.DataFrame:
-    """ Get the average transaction amounts for each truck, grouped by hour """
+@st.cache_data(ttl=300)
+def get_average_transaction_amounts() -> pd.DataFrame:
+    """ Get the average transaction amounts for each truck, grouped by hour in Athena """
+
+    sql_query = """
+    SELECT
+        truck_name,
+        CAST(HOUR(at) AS TINYINT) AS hour_of_day,
+        AVG(total) / 100 AS average_transaction_amount
+    FROM transaction_table
+    GROUP BY 1, 2
+    """
 
-    average_amount = df.groupby(['truck_name', df['at'].dt.hour])[
-        'total_pounds'].mean().reset_index()
+    average_amount = get_athena_query(sql_query)
 
-    average_amount = average_amount.rename(
-        columns={'total_pounds': 'average_transaction_amount',
-                 'at': 'hour_of_day'})
+    # Integer and categorical keys sort and hash faster than int64 and strings
+    average_amount['truck_name'] = average_amount['truck_name'].astype('category')
+    average_amount['hour_of_day'] = average_amount['hour_of_day'].astype('int8')
+    average_amount['average_transaction_amount'] = average_amount[
+        'average_transaction_amount'].astype('float32')
 
-    average_amount = average_amount.sort_values(
-        by=['truck_name', 'hour_of_day'])
+    average_amount.sort_values(by=['truck_name', 'hour_of_day'], inplace=True)
 
     return average_amount
 
@@ -0,0 +1,87 @@
+# pylint: disable=invalid-name
+
+""" One-off migration that adds the denormalized truck_name and payment_method
+columns to the transaction_table Parquet files written before they existed,
+then builds the truck_daily_totals table from the full transaction history.
+Files are rewritten in place, one at a time, so transactions appended by the
+periodic pipeline are kept and the Parameter Store watermark is left alone. """
+
+import pandas as pd
+import awswrangler as wr
+
+from upload_to_s3 import TRANSACTION_S3_PATH, ROOT_S3_PATH, upload_truck_daily_totals_to_s3
+
+DENORMALIZED_COLUMNS = ['truck_name', 'payment_method']
+
+
+def get_dimension_tables() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """ Get the truck and payment method dimension tables from S3 """
+
+    truck_df = wr.s3.read_parquet(
+        path=ROOT_S3_PATH + 'truck_table/', dataset=True)
+    payment_df = wr.s3.read_parquet(
+        path=ROOT_S3_PATH + 'payment_table/', dataset=True)
+
+    return truck_df, payment_df
+
+
+def backfill_transaction_file(file_path: str, truck_df: pd.DataFrame,
+                              payment_df: pd.DataFrame) -> bool:
+    """ Add the truck name and payment method to one transaction file and write it
+    back to the same key. Returns False if the file already has both columns """
+
+    transaction_df = wr.s3.read_parquet(path=file_path)
+
+    if set(DENORMALIZED_COLUMNS).issubset(transaction_df.columns):
+        return False
+
+    # Left joins, unlike join_dimensions, so the migration never drops stored rows
+    transaction_df = transaction_df.drop(
+        columns=DENORMALIZED_COLUMNS, errors='ignore').merge(
+        truck_df[['truck_id', 'truck_name']], on='truck_id', how='left').merge(
+        payment_df[['payment_method_id', 'payment_method']], on='payment_method_id',
+        how='left')
+
+    wr.s3.to_parquet(
+        df=transaction_df,
+        path=file_path,
+        compression='zstd'
+    )
+
+    return True
+
+
+def backfill_transaction_table() -> int:
+    """ Backfill every transaction file missing the denormalized columns.
+    Safe to re-run, as files that already have them are skipped.
+    Returns the number of files rewritten """
+
+    truck_df, payment_df = get_dimension_tables()
+
+    rewritten = 0
+    for file_path in wr.s3.list_objects(TRANSACTION_S3_PATH, suffix='.parquet'):
+        if backfill_transaction_file(file_path, truck_df, payment_df):
+            rewritten += 1
+
+    return rewritten
+
+
+def rebuild_truck_daily_totals() -> None:
+    """ Rebuild the truck_daily_totals table from every stored transaction """
+
+    transaction_df = wr.s3.read_parquet(
+        path=TRANSACTION_S3_PATH,
+        dataset=True,
+        columns=['truck_name', 'total', 'at']
+    )
+
+    upload_truck_daily_totals_to_s3(transaction_df)
+
+
+if __name__ == "__main__":
+
+    files_rewritten = backfill_transaction_table()
+    print(f"Backfilled {files_rewritten} transaction files in S3.")
+
+    rebuild_truck_daily_totals()
+    print("Rebuilt truck daily totals in S3.")
@@ -1,15 +1,21 @@
 # pylint: disable=invalid-name
 
-""" Extract script to download data from the RDS database 
-and save each table to its own csv file. """
+""" Extract script to download data from the RDS database, clean it,
+and upload each table straight to S3 in Parquet format. """
 
 import os
 import pandas as pd
 from pandas import DataFrame
 import pymysql.cursors
 from pymysql.connections import Connection
+from pymysql.cursors import Cursor
 from dotenv import load_dotenv
 
+from upload_to_s3 import (join_dimensions,
+                          upload_transactions_to_s3,
+                          upload_truck_daily_totals_to_s3,
+                          upload_dimensions_to_s3)
+
 
 def get_connection_to_db() -> Connection:
     """ Establish a connection to the RDS database using environment variables"""
@@ -21,11 +27,32 @@ def get_connection_to_db() -> Connection:
                                  user=config.get("DB_USER"),
                                  password=config.get("DB_PASSWORD"),
                                  database=config.get("DB_NAME"),
-                                 cursorclass=pymysql.cursors.DictCursor)
+                                 cursorclass=pymysql.cursors.Cursor)
 
     return connection
 
 
+# Also copied into pipeline_periodic/extract_and_upload_periodic.py;
+# keep the two in sync
+def get_dataframe_from_cursor(cur: Cursor, batch_size: int = 100_000) -> DataFrame:
+    """ Build a pandas dataframe from the rows of an executed query, reading plain
+    tuples in batches and taking the column names from the cursor description.
+    With an unbuffered cursor only one batch of raw rows is held at a time """
+
+    columns = [column[0] for column in cur.description]
+
+    batches = []
+    while rows := cur.fetchmany(batch_size):
+        batches.append(pd.DataFrame.from_records(rows, columns=columns))
+
+    if not batches:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(batches, ignore_index=True)
+
+    return df
+
+
 def get_payment_table(connection: Connection) -> DataFrame:
     """ Get the "DIM_Payment_Method" table from the database as a pandas dataframe"""
 
@@ -34,7 +61,7 @@ def get_payment_table(connection: Connection) -> DataFrame:
         SELECT * FROM DIM_Payment_Method;
         """
         cur.execute(sql_query)
-        payment_df = pd.DataFrame(cur.fetchall())
+        payment_df = get_dataframe_from_cursor(cur)
 
     return payment_df
 
@@ -47,38 +74,43 @@ def get_truck_table(connection: Connection) -> DataFrame:
         SELECT * FROM DIM_Truck;
         """
         cur.execute(sql_query)
-        truck_df = pd.DataFrame(cur.fetchall())
+        truck_df = get_dataframe_from_cursor(cur)
 
     return truck_df
 
 
 def get_transaction_table(connection: Connection) -> DataFrame:
-    """ Get the historical data from the "FACT_Transaction" 
-    table from the database as a pandas dataframe"""
+    """ Get the valid historical data from the "FACT_Transaction" 
+    table from the database as a pandas dataframe. Rows are validated by
+    MySQL so invalid ones are never sent over the network:
+        - total should be greater than 0
+        - truck_id should be between 1 and 6 inclusive 
+        - payment_method_id should be 1 or 2
+        - no column should be null (the comparisons above also reject nulls) """
 
     HISTORICAL_CUTOFF_DATE = '2025-10-25 23:58:00'
 
-    with connection.cursor() as cur:
-        sql_query = f"""
+    # Stream the rows with an unbuffered cursor instead of buffering the whole result
+    with connection.cursor(pymysql.cursors.SSCursor) as cur:
+        sql_query = """
         SELECT * FROM FACT_Transaction
-        WHERE at <= '{HISTORICAL_CUTOFF_DATE}';
+        WHERE at <= %s
+            AND total > 0
+            AND truck_id BETWEEN 1 AND 6
+            AND payment_method_id IN (1, 2)
+            AND transaction_id IS NOT NULL;
         """
-        cur.execute(sql_query)
-        transaction_df = pd.DataFrame(cur.fetchall())
+        cur.execute(sql_query, (HISTORICAL_CUTOFF_DATE,))
+        transaction_df = get_dataframe_from_cursor(cur)
 
     return transaction_df
 
 
 def clean_transaction_data(df: DataFrame) -> DataFrame:
-    """ Clean the transaction data using the following conditions:
-        - total should be greater than 0
-        - truck_id should be between 1 and 6 inclusive 
-        - payment_method_id should be 1 or 2 """
+    """ Clean the transaction data by removing duplicate rows. The remaining
+    validation conditions are applied in the SQL query of get_transaction_table """
 
-    df_cleaned = df.dropna().drop_duplicates().reset_index(drop=True)
-    df_cleaned = df_cleaned[(df_cleaned['total'] > 0) &
-                            (df_cleaned['truck_id'].between(1, 6)) &
-                            (df_cleaned['payment_method_id'].isin([1, 2]))].reset_index(drop=True)
+    df_cleaned = df.drop_duplicates().reset_index(drop=True)
 
     return df_cleaned
 
@@ -92,22 +124,16 @@ if __name__ == "__main__":
 
     transaction_data = get_transaction_table(conn)
     transaction_data_cleaned = clean_transaction_data(transaction_data)
+    transaction_data_cleaned = join_dimensions(
+        transaction_data_cleaned, truck_data, payment_data)
 
     conn.close()
 
-    PAYMENT_CSV_PATH = "./data/payment_data.csv"
-    TRUCK_CSV_PATH = "./data/truck_data.csv"
-    TRANSACTION_CSV_PATH = "./data/transaction_data.csv"
-
-    if not os.path.exists("./data"):
-        os.makedirs("./data")
-
-    payment_data.to_csv(PAYMENT_CSV_PATH, index=False)
-    print(f"Payment data extracted and saved to {PAYMENT_CSV_PATH}")
+    upload_transactions_to_s3(transaction_data_cleaned)
+    print("Uploaded transactions data to S3.")
 
-    truck_data.to_csv(TRUCK_CSV_PATH, index=False)
-    print(f"Truck data extracted and saved to {TRUCK_CSV_PATH}")
+    upload_truck_daily_totals_to_s3(transaction_data_cleaned)
+    print("Uploaded truck daily totals to S3.")
 
-    transaction_data_cleaned.to_csv(
-        TRANSACTION_CSV_PATH, index=False)
-    print(f"Transaction data extracted and saved to {TRANSACTION_CSV_PATH}")
+    upload_dimensions_to_s3(truck_data, payment_data)
+    print("Uploaded dimensions data to S3.")
@@ -1,46 +1,89 @@
 # pylint: disable=invalid-name
 
-""" Upload script that uses AWS Wrangler to upload 
-CSV data to time-partitioned S3 buckets in Parquet format. """
+""" Upload script that uses AWS Wrangler to upload the extracted
+dataframes to time-partitioned S3 buckets in Parquet format. """
 
 import pandas as pd
 import awswrangler as wr
 
-PAYMENT_DATA_LOCAL_PATH = './data/payment_data.csv'
-TRANSACTION_DATA_LOCAL_PATH = './data/transaction_data.csv'
-TRUCK_DATA_LOCAL_PATH = './data/truck_data.csv'
-
 TRANSACTION_S3_PATH = 's3://c20-muarij-t3-data-lake/transaction_table/'
+TRUCK_DAILY_TOTALS_S3_PATH = 's3://c20-muarij-t3-data-lake/truck_daily_totals/'
 ROOT_S3_PATH = 's3://c20-muarij-t3-data-lake/'
 
 
-def upload_transactions_to_s3():
+# Also copied into pipeline_periodic/extract_and_upload_periodic.py;
+# keep the two in sync so both write the same denormalized columns
+def join_dimensions(transaction_df: pd.DataFrame, truck_df: pd.DataFrame,
+                    payment_df: pd.DataFrame) -> pd.DataFrame:
+    """ Add the truck name and payment method to each transaction, so queries
+    can read them from the transaction table without joining the dimensions.
+    Transactions without a matching truck or payment method are dropped,
+    as an inner join would """
+
+    transaction_df = transaction_df.merge(
+        truck_df[['truck_id', 'truck_name']], on='truck_id').merge(
+        payment_df[['payment_method_id', 'payment_method']], on='payment_method_id')
+
+    return transaction_df
+
+
+def upload_transactions_to_s3(transaction_df: pd.DataFrame) -> None:
     """ Upload transactions data to S3 in Parquet format with partitioning """
 
-    transaction_df = pd.read_csv(TRANSACTION_DATA_LOCAL_PATH)
-    transaction_df['at'] = pd.to_datetime(transaction_df['at'])
+    # Extract date components for partitioning, on a new frame so the
+    # caller's transactions are left as they were passed in
+    partitioned_df = transaction_df.assign(
+        year=transaction_df['at'].dt.year,
+        month=transaction_df['at'].dt.month,
+        day=transaction_df['at'].dt.day)
 
-    # Extract date components for partitioning
-    transaction_df['year'] = transaction_df['at'].dt.year
-    transaction_df['month'] = transaction_df['at'].dt.month
-    transaction_df['day'] = transaction_df['at'].dt.day
+    # Sort by truck so each row group covers a narrow truck_id range,
+    # letting Athena skip row groups using the Parquet min/max statistics
+    partitioned_df = partitioned_df.sort_values(['truck_id', 'at'])
 
     # Write to S3 with partitioning
     wr.s3.to_parquet(
-        df=transaction_df,
+        df=partitioned_df,
         path=TRANSACTION_S3_PATH,
         dataset=True,
         partition_cols=['year', 'month', 'day'],
+        compression='zstd',
+        max_rows_by_file=1_000_000,
         mode='overwrite'
     )
 
 
-def upload_dimensions_to_s3():
+# Also copied into pipeline_periodic/extract_and_upload_periodic.py;
+# keep the two in sync so both write the same daily totals
+def get_truck_daily_totals(transaction_df: pd.DataFrame) -> pd.DataFrame:
+    """ Get the total revenue in pounds per truck per day """
+
+    daily_totals = transaction_df.groupby(
+        ['truck_name', transaction_df['at'].dt.date.rename('date')], observed=True)[
+        'total'].sum().reset_index()
+
+    daily_totals['total_pounds'] = daily_totals.pop('total') / 100
+
+    return daily_totals
+
+
+def upload_truck_daily_totals_to_s3(transaction_df: pd.DataFrame) -> None:
+    """ Upload the daily revenue per truck to S3 in Parquet format, as a small
+    pre-aggregated table the dashboard can read instead of every transaction.
+    The periodic pipeline keeps it up to date afterwards """
+
+    wr.s3.to_parquet(
+        df=get_truck_daily_totals(transaction_df),
+        path=TRUCK_DAILY_TOTALS_S3_PATH,
+        dataset=True,
+        mode='overwrite'
+    )
+
+
+def upload_dimensions_to_s3(truck_df: pd.DataFrame, payment_df: pd.DataFrame) -> None:
     """ Upload dimensions data (Truck data + Payment data) 
     to S3 in Parquet format without partitioning """
 
-    truck_df = pd.read_csv(TRUCK_DATA_LOCAL_PATH)
-
     # Write truck data to S3 without partitioning
     wr.s3.to_parquet(
         df=truck_df,
@@ -49,8 +92,6 @@ def upload_dimensions_to_s3():
         mode='overwrite'
     )
 
-    payment_df = pd.read_csv(PAYMENT_DATA_LOCAL_PATH)
-
     # Write payment data to S3 without partitioning
     wr.s3.to_parquet(
         df=payment_df,
@@ -58,10 +99,3 @@ def upload_dimensions_to_s3():
         dataset=True,
         mode='overwrite'
     )
-
-
-if __name__ == "__main__":
-    upload_transactions_to_s3()
-    print("Uploaded transactions data to S3.")
-    upload_dimensions_to_s3()
-    print("Uploaded dimensions data to S3.")
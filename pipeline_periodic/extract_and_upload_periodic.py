@@ -9,9 +9,13 @@ import boto3
 import pymysql.cursors
 import pandas as pd
 from pymysql.connections import Connection
+from pymysql.cursors import Cursor
 from dotenv import load_dotenv
 import awswrangler as wr
 
+TRANSACTION_S3_PATH = 's3://c20-muarij-t3-data-lake/transaction_table/'
+TRUCK_DAILY_TOTALS_S3_PATH = 's3://c20-muarij-t3-data-lake/truck_daily_totals/'
+
 
 def get_connection_to_db() -> Connection:
     """ Establish a connection to the RDS database using environment variables"""
@@ -23,11 +27,58 @@ def get_connection_to_db() -> Connection:
                                  user=config.get("DB_USER"),
                                  password=config.get("DB_PASSWORD"),
                                  database=config.get("DB_NAME"),
-                                 cursorclass=pymysql.cursors.DictCursor)
+                                 cursorclass=pymysql.cursors.Cursor)
 
     return connection
 
 
+# Copied from pipeline/extract_and_clean.py (the pipelines ship as separate images);
+# keep the two in sync
+def get_dataframe_from_cursor(cur: Cursor, batch_size: int = 100_000) -> pd.DataFrame:
+    """ Build a pandas dataframe from the rows of an executed query, reading plain
+    tuples in batches and taking the column names from the cursor description.
+    With an unbuffered cursor only one batch of raw rows is held at a time """
+
+    columns = [column[0] for column in cur.description]
+
+    batches = []
+    while rows := cur.fetchmany(batch_size):
+        batches.append(pd.DataFrame.from_records(rows, columns=columns))
+
+    if not batches:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(batches, ignore_index=True)
+
+    return df
+
+
+def get_payment_table(connection: Connection) -> pd.DataFrame:
+    """ Get the "DIM_Payment_Method" table from the database as a pandas dataframe"""
+
+    with connection.cursor() as cur:
+        sql_query = """
+        SELECT * FROM DIM_Payment_Method;
+        """
+        cur.execute(sql_query)
+        payment_df = get_dataframe_from_cursor(cur)
+
+    return payment_df
+
+
+def get_truck_table(connection: Connection) -> pd.DataFrame:
+    """ Get the "DIM_Truck" table from the database as a pandas dataframe"""
+
+    with connection.cursor() as cur:
+        sql_query = """
+        SELECT * FROM DIM_Truck;
+        """
+        cur.execute(sql_query)
+        truck_df = get_dataframe_from_cursor(cur)
+
+    return truck_df
+
+
 def get_latest_transaction_date() -> str:
     """ Retrieve the latest processed transaction date from AWS Systems Manager Parameter Store """
 
@@ -39,45 +90,132 @@ def get_latest_transaction_date() -> str:
     return LATEST_TRANSACTION_DATE
 
 
-def get_latest_transaction_data(connection: Connection) -> pd.DataFrame:
+def get_latest_transaction_data(connection: Connection,
+                                latest_transaction_date: str) -> pd.DataFrame:
     """ Get new transaction data from RDS newer than the last processed timestamp
         stored in Parameter Store """
 
-    latest_transaction_date = get_latest_transaction_date()
-
-    with connection.cursor() as cur:
-        sql_query = f"""
+    # Stream the rows with an unbuffered cursor instead of buffering the whole result
+    with connection.cursor(pymysql.cursors.SSCursor) as cur:
+        sql_query = """
         SELECT * FROM FACT_Transaction
-        WHERE at > '{latest_transaction_date}';
+        WHERE at > %s;
         """
-        cur.execute(sql_query)
-        transaction_df = pd.DataFrame(cur.fetchall())
+        cur.execute(sql_query, (latest_transaction_date,))
+        transaction_df = get_dataframe_from_cursor(cur)
+
+    return transaction_df
+
+
+# Copied from pipeline/upload_to_s3.py (the pipelines ship as separate images);
+# keep the two in sync so both write the same denormalized columns
+def join_dimensions(transaction_df: pd.DataFrame, truck_df: pd.DataFrame,
+                    payment_df: pd.DataFrame) -> pd.DataFrame:
+    """ Add the truck name and payment method to each transaction, so queries
+    can read them from the transaction table without joining the dimensions.
+    Transactions without a matching truck or payment method are dropped,
+    as an inner join would """
+
+    transaction_df = transaction_df.merge(
+        truck_df[['truck_id', 'truck_name']], on='truck_id').merge(
+        payment_df[['payment_method_id', 'payment_method']], on='payment_method_id')
 
     return transaction_df
 
 
-def upload_latest_transactions_to_s3(transaction_df: pd.DataFrame) -> None:
-    """ Upload latest transactions data to S3 in Parquet format with partitioning """
+def upload_latest_transactions_to_s3(transaction_df: pd.DataFrame,
+                                     latest_transaction_date: str) -> None:
+    """ Upload latest transactions data to S3 in Parquet format with partitioning.
+    Files are named after the timestamp the batch starts from, so a retried run
+    replaces its own earlier output instead of appending the same rows twice """
 
-    TRANSACTION_S3_PATH = 's3://c20-muarij-t3-data-lake/transaction_table/'
+    # Extract date components for partitioning, on a new frame so the
+    # caller's transactions are left as they were passed in
+    at = pd.to_datetime(transaction_df['at'])
+    partitioned_df = transaction_df.assign(
+        at=at, year=at.dt.year, month=at.dt.month, day=at.dt.day)
 
-    transaction_df['at'] = pd.to_datetime(transaction_df['at'])
+    # A retry starts from the same last processed timestamp, so it shares the prefix
+    batch_prefix = f"batch_{pd.Timestamp(latest_transaction_date):%Y%m%dT%H%M%S}_"
 
-    # Extract date components for partitioning
-    transaction_df['year'] = transaction_df['at'].dt.year
-    transaction_df['month'] = transaction_df['at'].dt.month
-    transaction_df['day'] = transaction_df['at'].dt.day
+    # Remove any files left in these partitions by an earlier attempt at this batch
+    partitions = partitioned_df[['year', 'month', 'day']].drop_duplicates()
+    for year, month, day in partitions.itertuples(index=False):
+        wr.s3.delete_objects(
+            f"{TRANSACTION_S3_PATH}year={year}/month={month}/day={day}/{batch_prefix}")
 
-    # Write to S3 with partitioning, without overwriting entire file structure.
+    # Sort by truck so Athena can skip row groups using the Parquet statistics
+    partitioned_df = partitioned_df.sort_values(['truck_id', 'at'])
+
+    # Write to S3 with partitioning, without overwriting other batches in the same partitions.
     wr.s3.to_parquet(
-        df=transaction_df,
+        df=partitioned_df,
         path=TRANSACTION_S3_PATH,
         dataset=True,
         partition_cols=['year', 'month', 'day'],
+        compression='zstd',
+        filename_prefix=batch_prefix,
         mode='append'
     )
 
 
+# Copied from pipeline/upload_to_s3.py (the pipelines ship as separate images);
+# keep the two in sync so both write the same daily totals
+def get_truck_daily_totals(transaction_df: pd.DataFrame) -> pd.DataFrame:
+    """ Get the total revenue in pounds per truck per day """
+
+    daily_totals = transaction_df.groupby(
+        ['truck_name', transaction_df['at'].dt.date.rename('date')], observed=True)[
+        'total'].sum().reset_index()
+
+    daily_totals['total_pounds'] = daily_totals.pop('total') / 100
+
+    return daily_totals
+
+
+def update_truck_daily_totals_in_s3(transaction_df: pd.DataFrame,
+                                    truck_df: pd.DataFrame) -> None:
+    """ Recompute the daily revenue per truck for the days covered by the latest
+    transactions and replace those days in the truck_daily_totals table.
+    The days are recomputed from the stored transactions rather than incremented,
+    so a retried run cannot count a batch twice """
+
+    # Partition values are read back as strings, e.g. ('2025', '11', '4')
+    at = pd.to_datetime(transaction_df['at'])
+    affected_days = set(zip(at.dt.year.astype(str), at.dt.month.astype(str),
+                            at.dt.day.astype(str)))
+
+    day_transactions = wr.s3.read_parquet(
+        path=TRANSACTION_S3_PATH,
+        dataset=True,
+        partition_filter=lambda partition: (
+            partition['year'], partition['month'], partition['day']) in affected_days,
+        columns=['truck_id', 'total', 'at']
+    )
+
+    # Name the trucks from the dimension table rather than the stored truck_name,
+    # which files written before it was denormalized do not have
+    day_totals = get_truck_daily_totals(day_transactions.merge(
+        truck_df[['truck_id', 'truck_name']], on='truck_id'))
+
+    try:
+        daily_totals = wr.s3.read_parquet(
+            path=TRUCK_DAILY_TOTALS_S3_PATH, dataset=True)
+        daily_totals = pd.concat(
+            [daily_totals[~daily_totals['date'].isin(day_totals['date'])], day_totals],
+            ignore_index=True)
+    except wr.exceptions.NoFilesFound:
+        daily_totals = day_totals
+
+    # One row per truck per day, so rewriting the whole table is cheap
+    wr.s3.to_parquet(
+        df=daily_totals,
+        path=TRUCK_DAILY_TOTALS_S3_PATH,
+        dataset=True,
+        mode='overwrite'
+    )
+
+
 def update_latest_transaction_date(transaction_df: pd.DataFrame) -> None:
     """ Update the latest processed transaction date in AWS Systems Manager Parameter Store """
 
@@ -98,13 +236,22 @@ if __name__ == "__main__":
     conn = get_connection_to_db()
     print("Connection to RDS established.")
 
-    latest_transaction_data = get_latest_transaction_data(conn)
+    last_processed_date = get_latest_transaction_date()
+    latest_transaction_data = get_latest_transaction_data(
+        conn, last_processed_date)
     print(
         f"Retrieved {len(latest_transaction_data)} new transaction records from RDS.")
 
     if not latest_transaction_data.empty:
-        upload_latest_transactions_to_s3(latest_transaction_data)
+        truck_data = get_truck_table(conn)
+        payment_data = get_payment_table(conn)
+        latest_transaction_data_joined = join_dimensions(
+            latest_transaction_data, truck_data, payment_data)
+        upload_latest_transactions_to_s3(
+            latest_transaction_data_joined, last_processed_date)
         print("Uploaded latest transactions to S3.")
+        update_truck_daily_totals_in_s3(latest_transaction_data_joined, truck_data)
+        print("Updated truck daily totals in S3.")
         update_latest_transaction_date(latest_transaction_data)
         print("Updated latest transaction date in Parameter Store.")
 
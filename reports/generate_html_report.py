@@ -8,32 +8,50 @@ generates comprehensive HTML reports with performance metrics.
 
 import os
 from datetime import datetime, timedelta
+from typing import Iterator
+import numpy as np
 import pandas as pd
-import awswrangler as wr
-
-
-def get_combined_data() -> pd.DataFrame:
-    """ Get all of yesterday's data from S3 as a pandas DataFrame using awswrangler """
-
-    sql_query = """
+from jinja2 import Environment, FileSystemLoader
+
+
+def get_combined_data(report_date: str) -> pd.DataFrame:
+    """ Get a day's revenue and transaction counts from S3 as a pandas DataFrame,
+    aggregated by truck, hour and price segment in Athena using awswrangler """
+
+    # Every report metric is a roll-up of this (truck, hour, segment) cube, so
+    # Athena returns a few hundred rows at most instead of every transaction.
+    # total is in pence, so pence are summed exactly before one float division.
+    # The day is a literal rather than CURRENT_DATE so cached results of one
+    # day's query are never reused for the next. The crawler types the year,
+    # month and day partitions as unpadded strings; filtering on them lets
+    # Athena prune to the one day's files instead of scanning every partition.
+    # truck_name is read from transaction_table, so files written before it
+    # was denormalized must be backfilled first (see the README migration steps)
+    day = pd.Timestamp(report_date)
+    sql_query = f"""
     SELECT
-        transaction_id, 
-        dt.truck_name, 
-        dpm.payment_method, 
-        total/100 AS total_pounds, 
-        at, 
-        has_card_reader,
-        fsa_rating
-    FROM transaction_table AS ft
-    JOIN payment_table AS dpm
-        ON ft.payment_method_id = dpm.payment_method_id 
-    JOIN truck_table AS dt
-        ON ft.truck_id = dt.truck_id
-    WHERE DATE(at) = CURRENT_DATE - INTERVAL '1' DAY;
+        truck_name,
+        CAST(HOUR(at) AS TINYINT) AS hour,
+        CASE
+            WHEN total <= 500 THEN 'Low (£0-5)'
+            WHEN total <= 1000 THEN 'Medium (£5-10)'
+            ELSE 'High (£10+)'
+        END AS price_segment,
+        COUNT(*) AS transaction_count,
+        CAST(SUM(total) AS DOUBLE) / 100 AS total_pounds
+    FROM transaction_table
+    WHERE year = '{day.year}' AND month = '{day.month}' AND day = '{day.day}'
+        AND DATE(at) = DATE '{report_date}'
+    GROUP BY 1, 2, 3;
     """
 
     df = run_athena_query(sql_query)
 
+    # Group on integer category codes rather than hashing the name strings,
+    # and keep the hour key at one byte per row
+    df['truck_name'] = df['truck_name'].astype('category')
+    df['hour'] = df['hour'].astype('int8')
+
     return df
 
 
@@ -41,332 +59,250 @@ def run_athena_query(query: str) -> pd.DataFrame:
     """ Execute an Athena query on an AWS Glue Data Catalog 
     and return the results as a pandas DataFrame """
 
+    # awswrangler pulls in boto3 and pyarrow, so it is imported on first use
+    # rather than on every cold start; later calls hit the module cache
+    import awswrangler as wr  # pylint: disable=import-outside-toplevel
+
     DB_PATH = 'c20-muarij-t3-glue-db'
+    CACHE_SECONDS = 24 * 60 * 60
 
+    # A closed day's results never change, so retried or repeated runs
+    # reuse the previous query's results instead of rescanning S3.
+    # The aggregated result is only a few hundred rows, so it is read back
+    # directly rather than UNLOADed, which the result cache cannot match
     df = wr.athena.read_sql_query(
         sql=query,
         database=DB_PATH,
         ctas_approach=False,
-        workgroup="c20-muarij-t3-athena-workgroup"
+        workgroup="c20-muarij-t3-athena-workgroup",
+        athena_cache_settings={"max_cache_seconds": CACHE_SECONDS}
     )
 
     return df
 
 
-def get_best_performing_truck(df: pd.DataFrame) -> str:
+PRICE_SEGMENTS = ['Low (£0-5)', 'Medium (£5-10)', 'High (£10+)']
+
+
+def _aggregate(df: pd.DataFrame) -> dict:
+    """ Roll the report data up per truck, per truck and hour, and per price segment.
+    Computed once per report and shared by all the metric helpers """
+
+    # Ranked by revenue once, lowest first, for the best, worst and
+    # underperforming truck helpers
+    by_truck = df.groupby('truck_name', observed=True, sort=False).agg(
+        total_pounds=('total_pounds', 'sum'),
+        transaction_count=('transaction_count', 'sum')
+    ).sort_values('total_pounds', kind='stable')
+
+    # Revenue per truck per trading hour in one pass: each (truck, hour) pair
+    # is a flat bin over the truck category codes and the hour of day
+    HOURS_PER_DAY = 24
+    truck_names = df['truck_name'].cat.categories
+    bins = df['truck_name'].cat.codes.to_numpy(np.intp) * HOURS_PER_DAY + df['hour'].to_numpy()
+    n_bins = len(truck_names) * HOURS_PER_DAY
+
+    hour_revenue = np.bincount(bins, weights=df['total_pounds'].to_numpy(), minlength=n_bins)
+    hours_traded = np.bincount(bins, minlength=n_bins) > 0
+
+    by_truck_hour = pd.Series(
+        hour_revenue.reshape(-1, HOURS_PER_DAY).sum(axis=1)
+        / hours_traded.reshape(-1, HOURS_PER_DAY).sum(axis=1),
+        index=truck_names.rename('truck_name'),
+        name='avg_revenue_per_hour'
+    )
+
+    # Athena labels the segments; ordering them as a categorical makes the
+    # groupby below return the segments in price order
+    price_segment = pd.Categorical(df['price_segment'],
+                                   categories=PRICE_SEGMENTS,
+                                   ordered=True)
+
+    by_segment = df.groupby(price_segment, observed=True).agg(
+        transaction_count=('transaction_count', 'sum'),
+        total_pounds=('total_pounds', 'sum')
+    ).rename_axis('price_segment')
+
+    aggregates = {
+        'by_truck': by_truck,
+        'by_truck_hour': by_truck_hour,
+        'by_segment': by_segment
+    }
+
+    return aggregates
+
+
+def get_best_performing_truck(agg: dict) -> str:
     """ Get the best performing truck based on total revenue """
 
-    total_revenue = df.groupby('truck_name')[
-        'total_pounds'].sum().reset_index()
-    best_truck = total_revenue.loc[total_revenue['total_pounds'].idxmax()]
+    best_truck = agg['by_truck'].index[-1]
 
-    return best_truck['truck_name']
+    return best_truck
 
 
-def get_worst_performing_truck(df: pd.DataFrame) -> str:
+def get_worst_performing_truck(agg: dict) -> str:
     """ Get the worst performing truck based on total revenue """
 
-    total_revenue = df.groupby('truck_name')[
-        'total_pounds'].sum().reset_index()
-    worst_truck = total_revenue.loc[total_revenue['total_pounds'].idxmin()]
+    worst_truck = agg['by_truck'].index[0]
 
-    return worst_truck['truck_name']
+    return worst_truck
 
 
-def get_revenue_for_truck(df: pd.DataFrame, truck_name: str) -> float:
+def get_revenue_for_truck(agg: dict, truck_name: str) -> float:
     """ Get the total revenue for a specific truck """
 
-    truck_revenue = df[df['truck_name'] == truck_name]['total_pounds'].sum()
+    truck_revenue = agg['by_truck'].at[truck_name, 'total_pounds']
 
     return truck_revenue
 
 
-def get_total_daily_revenue(df: pd.DataFrame) -> float:
+def get_total_daily_revenue(agg: dict) -> float:
     """ Get the total daily revenue across all trucks """
 
-    total_revenue = df['total_pounds'].sum()
+    total_revenue = agg['by_truck']['total_pounds'].sum()
 
     return total_revenue
 
 
 # ==================== COST REDUCTION METRICS ====================
 
-def get_underperforming_trucks(df: pd.DataFrame, threshold_percentile: int = 25) -> pd.DataFrame:
+def get_underperforming_trucks(agg: dict, threshold_percentile: int = 25) -> pd.DataFrame:
     """ Identify underperforming trucks below the specified percentile.
     Useful for identifying trucks that may need intervention or reallocation. """
 
-    truck_performance = df.groupby('truck_name').agg({
-        'total_pounds': 'sum',
-        'transaction_id': 'count'
-    }).reset_index()
-
-    truck_performance['revenue_per_transaction'] = (
-        truck_performance['total_pounds'] / truck_performance['transaction_id']
-    )
-
     # Calculate threshold
-    revenue_threshold = truck_performance['total_pounds'].quantile(
-        threshold_percentile / 100)
+    revenue = agg['by_truck']['total_pounds']
+    revenue_threshold = revenue.quantile(threshold_percentile / 100)
+
+    # Trucks are already ranked by revenue, so those below the threshold
+    # are the leading slice up to its insertion point
+    underperformers = agg['by_truck'].iloc[
+        :revenue.searchsorted(revenue_threshold)].reset_index()
 
-    underperformers = truck_performance[
-        truck_performance['total_pounds'] < revenue_threshold
-    ].sort_values('total_pounds')
+    underperformers['revenue_per_transaction'] = (
+        underperformers['total_pounds'] / underperformers['transaction_count']
+    )
 
     return underperformers
 
 
 # ==================== PROFIT OPTIMIZATION METRICS ====================
 
-def get_transaction_velocity_by_truck(df: pd.DataFrame) -> pd.DataFrame:
+def get_transaction_velocity_by_truck(agg: dict) -> pd.DataFrame:
     """ Calculate average revenue per hour by truck to identify efficiency opportunities. """
 
-    df_copy = df.copy()
-    df_copy['hour'] = df_copy['at'].dt.hour
-
-    velocity = df_copy.groupby(['truck_name', 'hour']).agg({
-        'total_pounds': 'sum'  # Revenue per hour per truck
-    }).reset_index()
-
-    # Calculate average revenue per hour per truck
-    avg_velocity = velocity.groupby('truck_name').agg({
-        'total_pounds': 'mean'
-    }).reset_index()
-
-    avg_velocity = avg_velocity.rename(columns={
-        'total_pounds': 'avg_revenue_per_hour'
-    })
+    # Average revenue per hour per truck, over the hours each truck traded
+    avg_velocity = agg['by_truck_hour'].reset_index()
 
     return avg_velocity.sort_values('avg_revenue_per_hour', ascending=False)
 
 
 # ==================== DEMAND ANALYSIS METRICS ====================
 
-def categorize_price(price):
-    """ Categorize price into segments """
-
-    if price <= 5.0:
-        return 'Low (£0-5)'
-    elif price <= 10.0:
-        return 'Medium (£5-10)'
-    else:
-        return 'High (£10+)'
-
-
-def get_price_point_segmentation(df: pd.DataFrame) -> pd.DataFrame:
+def get_price_point_segmentation(agg: dict) -> pd.DataFrame:
     """ Segment transactions by price point to understand demand at different price levels.
-    Low: £0-5, Medium: £5-10, High: £10+ """
+    Low: £0-5, Medium: £5-10, High: £10+. Indexed by price segment, in price order """
 
-    df_copy = df.copy()
-
-    df_copy['price_segment'] = df_copy['total_pounds'].apply(categorize_price)
-
-    segmentation = df_copy.groupby('price_segment').agg({
-        'transaction_id': 'count',
-        'total_pounds': 'sum'
-    }).reset_index()
+    segmentation = agg['by_segment'].copy()
 
     segmentation['percentage_of_transactions'] = (
-        segmentation['transaction_id'] / segmentation['transaction_id'].sum()) * 100
+        segmentation['transaction_count'] / segmentation['transaction_count'].sum()) * 100
     segmentation['percentage_of_revenue'] = (
         segmentation['total_pounds'] / segmentation['total_pounds'].sum()) * 100
 
-    # Reorder by price level
-    order = ['Low (£0-5)', 'Medium (£5-10)', 'High (£10+)']
-    segmentation['price_segment'] = pd.Categorical(
-        segmentation['price_segment'], categories=order, ordered=True)
-    segmentation = segmentation.sort_values('price_segment')
-
     return segmentation
 
 
-def generate_html_report(df: pd.DataFrame) -> str:
-    """ Generate the report content as HTML with inline styles for email compatibility """
+# ==================== HTML REPORT ====================
 
-    # Get yesterday's date for the report
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+# Compiled once per container so warm invocations only pay for rendering
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+).get_template('report.html.j2')
 
-    # Get metrics
-    total_revenue = get_total_daily_revenue(df)
-    best_truck = get_best_performing_truck(df)
-    best_truck_revenue = get_revenue_for_truck(df, best_truck)
-    worst_truck = get_worst_performing_truck(df)
-    worst_truck_revenue = get_revenue_for_truck(df, worst_truck)
 
-    price_seg = get_price_point_segmentation(df)
-    most_demanded = price_seg.loc[price_seg['transaction_id'].idxmax()]
+def iter_html_report(df: pd.DataFrame, yesterday: str, year: int) -> Iterator[str]:  # pylint: disable=too-many-locals
+    """ Generate the report content as HTML with inline styles for email compatibility,
+    yielded in chunks as the template renders so callers can stream it """
 
-    underperformers = get_underperforming_trucks(df)
-    velocity = get_transaction_velocity_by_truck(df)
-    dominant_segment = price_seg.loc[price_seg['percentage_of_revenue'].idxmax(
-    )]
+    # Get metrics
+    agg = _aggregate(df)
+    total_revenue = get_total_daily_revenue(agg)
+    best_truck = get_best_performing_truck(agg)
+    best_truck_revenue = get_revenue_for_truck(agg, best_truck)
+    worst_truck = get_worst_performing_truck(agg)
+    worst_truck_revenue = get_revenue_for_truck(agg, worst_truck)
+
+    price_seg = get_price_point_segmentation(agg)
+    # Keep the segment labels as the index so the headline segments are a
+    # single argmax plus a scalar lookup, with no row Series built
+    most_demanded = price_seg['transaction_count'].idxmax()
+    most_demanded_share = price_seg.at[most_demanded, 'percentage_of_transactions']
+
+    underperformers = get_underperforming_trucks(agg)
+    velocity = get_transaction_velocity_by_truck(agg)
+    dominant_segment = price_seg['percentage_of_revenue'].idxmax()
+    dominant_segment_share = price_seg.at[dominant_segment, 'percentage_of_revenue']
 
     # Email-compatible HTML with inline styles and table layouts
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    </head>
-    <body style="margin: 0; padding: 0; font-family: Arial, sans-serif; background-color: #f5f5f5;">
-        <table width="100%" cellpadding="0" cellspacing="0" style="background-color: #f5f5f5;">
-            <tr>
-                <td align="center" style="padding: 20px;">
-                    <table width="600" cellpadding="0" cellspacing="0" style="background-color: #ffffff; border-radius: 8px; overflow: hidden;">
-
-                        <!-- Header -->
-                        <tr>
-                            <td style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; text-align: center;">
-                                <h1 style="color: #ffffff; margin: 0; font-size: 24px;">🚚 T3 Food Truck Daily Report</h1>
-                                <p style="color: #ffffff; margin: 10px 0 0 0; opacity: 0.9;">Report Date: {yesterday}</p>
-                            </td>
-                        </tr>
-
-                        <!-- Executive Summary -->
-                        <tr>
-                            <td style="padding: 25px;">
-                                <h2 style="color: #667eea; border-bottom: 3px solid #667eea; padding-bottom: 10px; margin-top: 0;">Executive Summary</h2>
-
-                                <table width="100%" cellpadding="10" cellspacing="0">
-                                    <tr>
-                                        <td width="50%" style="background-color: #f8f9fa; border-left: 4px solid #667eea; padding: 15px; vertical-align: top;">
-                                            <div style="font-size: 12px; color: #666; margin-bottom: 5px;">Total Daily Revenue</div>
-                                            <div style="font-size: 24px; font-weight: bold; color: #333;">£{total_revenue:,.2f}</div>
-                                        </td>
-                                        <td width="50%" style="background-color: #f8f9fa; border-left: 4px solid #667eea; padding: 15px; vertical-align: top;">
-                                            <div style="font-size: 12px; color: #666; margin-bottom: 5px;">Most In-Demand Price Point</div>
-                                            <div style="font-size: 20px; font-weight: bold; color: #333;">{most_demanded['price_segment']}</div>
-                                            <div style="font-size: 11px; color: #888; margin-top: 5px;">{most_demanded['percentage_of_transactions']:.1f}% of transactions</div>
-                                        </td>
-                                    </tr>
-                                    <tr>
-                                        <td width="50%" style="background-color: #f8f9fa; border-left: 4px solid #667eea; padding: 15px; vertical-align: top;">
-                                            <div style="font-size: 12px; color: #666; margin-bottom: 5px;">Best Performing Truck</div>
-                                            <div style="font-size: 20px; font-weight: bold; color: #28a745;">{best_truck}</div>
-                                            <div style="font-size: 11px; color: #888; margin-top: 5px;">£{best_truck_revenue:,.2f}</div>
-                                        </td>
-                                        <td width="50%" style="background-color: #f8f9fa; border-left: 4px solid #667eea; padding: 15px; vertical-align: top;">
-                                            <div style="font-size: 12px; color: #666; margin-bottom: 5px;">Worst Performing Truck</div>
-                                            <div style="font-size: 20px; font-weight: bold; color: #dc3545;">{worst_truck}</div>
-                                            <div style="font-size: 11px; color: #888; margin-top: 5px;">£{worst_truck_revenue:,.2f}</div>
-                                        </td>
-                                    </tr>
-                                </table>
-                            </td>
-                        </tr>
-
-                        <!-- Cost Reduction Opportunities -->
-                        <tr>
-                            <td style="padding: 25px; padding-top: 0;">
-                                <h2 style="color: #667eea; border-bottom: 3px solid #667eea; padding-bottom: 10px;">Cost Reduction Opportunities</h2>
-                                <h3 style="color: #764ba2; margin-top: 20px;">Underperforming Trucks (Bottom 25%)</h3>
-    """
+    chunks = TEMPLATE.generate(
+        yesterday=yesterday,
+        year=year,
+        total_revenue=total_revenue,
+        best_truck=best_truck,
+        best_truck_revenue=best_truck_revenue,
+        worst_truck=worst_truck,
+        worst_truck_revenue=worst_truck_revenue,
+        most_demanded=most_demanded,
+        most_demanded_share=most_demanded_share,
+        dominant_segment=dominant_segment,
+        dominant_segment_share=dominant_segment_share,
+        # Rows are zipped from the few columns each table shows, so no
+        # per-row Series or namedtuple is built
+        underperformers=list(zip(underperformers['truck_name'].to_numpy(),
+                                 underperformers['total_pounds'].to_numpy())),
+        velocity=zip(velocity['truck_name'].to_numpy(),
+                     velocity['avg_revenue_per_hour'].to_numpy()),
+        price_seg=zip(price_seg.index.to_numpy(),
+                      price_seg['total_pounds'].to_numpy(),
+                      price_seg['percentage_of_revenue'].to_numpy())
+    )
 
-    if not underperformers.empty:
-        html += """
-                                <table width="100%" cellpadding="10" cellspacing="0" style="border-collapse: collapse; margin: 15px 0;">
-                                    <tr style="background-color: #667eea;">
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Truck Name</th>
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Daily Revenue</th>
-                                    </tr>
-        """
-        for _, row in underperformers.iterrows():
-            html += f"""
-                                    <tr style="border-bottom: 1px solid #e0e0e0;">
-                                        <td style="padding: 12px;">{row['truck_name']}</td>
-                                        <td style="padding: 12px;">£{row['total_pounds']:,.2f}</td>
-                                    </tr>
-            """
-        html += """
-                                </table>
-                                <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 15px 0; border-radius: 4px;">
-                                    <strong>💡 INSIGHT:</strong> These trucks may need menu optimization, repositioning, or operational review
-                                </div>
-        """
-    else:
-        html += '<p style="color: #28a745; font-weight: bold;">✓ No underperforming trucks identified</p>'
-
-    html += """
-                            </td>
-                        </tr>
-
-                        <!-- Profit Optimization Strategies -->
-                        <tr>
-                            <td style="padding: 25px; padding-top: 0;">
-                                <h2 style="color: #667eea; border-bottom: 3px solid #667eea; padding-bottom: 10px;">Profit Optimization Strategies</h2>
-                                <h3 style="color: #764ba2; margin-top: 20px;">Truck Efficiency - Revenue per Hour</h3>
-                                <table width="100%" cellpadding="10" cellspacing="0" style="border-collapse: collapse; margin: 15px 0;">
-                                    <tr style="background-color: #667eea;">
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Truck Name</th>
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Avg Revenue per Hour</th>
-                                    </tr>
-    """
+    return chunks
 
-    for _, row in velocity.iterrows():
-        html += f"""
-                                    <tr style="border-bottom: 1px solid #e0e0e0;">
-                                        <td style="padding: 12px;">{row['truck_name']}</td>
-                                        <td style="padding: 12px;">£{row['avg_revenue_per_hour']:.2f}/hour</td>
-                                    </tr>
-        """
-
-    html += """
-                                </table>
-                                <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 15px 0; border-radius: 4px;">
-                                    <strong>💡 INSIGHT:</strong> Lower revenue/hour trucks may benefit from menu simplification or repositioning for faster service
-                                </div>
-                            </td>
-                        </tr>
-
-                        <!-- Demand & Market Analysis -->
-                        <tr>
-                            <td style="padding: 25px; padding-top: 0;">
-                                <h2 style="color: #667eea; border-bottom: 3px solid #667eea; padding-bottom: 10px;">Demand & Market Analysis</h2>
-                                <h3 style="color: #764ba2; margin-top: 20px;">Price Point Demand Analysis</h3>
-                                <table width="100%" cellpadding="10" cellspacing="0" style="border-collapse: collapse; margin: 15px 0;">
-                                    <tr style="background-color: #667eea;">
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Price Segment</th>
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">Revenue</th>
-                                        <th style="color: white; padding: 12px; text-align: left; font-weight: 600;">% of Total Revenue</th>
-                                    </tr>
-    """
 
-    for _, row in price_seg.iterrows():
-        html += f"""
-                                    <tr style="border-bottom: 1px solid #e0e0e0;">
-                                        <td style="padding: 12px;">{row['price_segment']}</td>
-                                        <td style="padding: 12px;">£{row['total_pounds']:,.2f}</td>
-                                        <td style="padding: 12px;">{row['percentage_of_revenue']:.1f}%</td>
-                                    </tr>
-        """
-
-    html += f"""
-                                </table>
-                                <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 15px 0; border-radius: 4px;">
-                                    <strong>💡 INSIGHT:</strong> {dominant_segment['price_segment']} segment drives {dominant_segment['percentage_of_revenue']:.1f}% of revenue
-                                </div>
-                            </td>
-                        </tr>
-
-                        <!-- Footer -->
-                        <tr>
-                            <td style="text-align: center; padding: 20px; color: #666; font-size: 12px; background-color: #f8f9fa;">
-                                <p style="margin: 0;">Generated automatically by T3 Food Truck Analytics System</p>
-                                <p style="margin: 5px 0 0 0;">&copy; {datetime.now().year} T3 Food Trucks | Business Intelligence Report</p>
-                            </td>
-                        </tr>
-
-                    </table>
-                </td>
-            </tr>
-        </table>
-    </body>
-    </html>
-    """
+def generate_html_report(df: pd.DataFrame, yesterday: str, year: int) -> str:
+    """ Generate the whole report as a single HTML string """
+
+    html = "".join(iter_html_report(df, yesterday, year))
 
     return html
 
 
+def get_report_data() -> tuple[pd.DataFrame, str, int]:
+    """ Read the clock once and load yesterday's data for the report.
+    Returns the data, the report date and the current year for the footer """
+
+    now = datetime.now()
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    df = get_combined_data(yesterday)
+
+    return df, yesterday, now.year
+
+
+def get_report_filename(yesterday: str) -> str:
+    """ Get the file name for the report of a given day """
+
+    report_filename = f"t3_daily_report_{yesterday}.html"
+
+    return report_filename
+
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function for generating daily business intelligence report.
@@ -381,13 +317,12 @@ def lambda_handler(event, context):
 
     try:
         # Load yesterday's data
-        df = get_combined_data()
+        df, yesterday, year = get_report_data()
 
         # Generate the HTML report
-        html_report = generate_html_report(df)
+        html_report = generate_html_report(df, yesterday, year)
 
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        report_filename = f"t3_daily_report_{yesterday}.html"
+        report_filename = get_report_filename(yesterday)
 
         print(f"Report generated successfully: {report_filename}")
 
@@ -397,7 +332,8 @@ def lambda_handler(event, context):
             'message': f'Report generated successfully: {report_filename}'
         }
 
-    except Exception as e:
+    # Any failure is reported back to the Step Function as a 500 response
+    except Exception as e:  # pylint: disable=broad-exception-caught
         error_message = f"Error generating report: {str(e)}"
         print(error_message)
         return {
@@ -408,19 +344,20 @@ def lambda_handler(event, context):
 
 
 if __name__ == "__main__":
-    # For local testing
+    # For local testing, go through the Lambda handler's response path first
     print("Generating HTML report...")
     result = lambda_handler(None, None)
     if result['statusCode'] == 200:
         print(f"\n✅ {result['message']}")
 
-        # Save to file for local testing
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        report_filename = f"t3_daily_report_{yesterday}.html"
-        report_path = "./" + report_filename
+        # Save to file for local testing, streaming the chunks rather than
+        # rebuilding the report as one string; the repeated Athena query
+        # is served from the result cache
+        report_inputs = get_report_data()
+        report_path = "./" + get_report_filename(report_inputs[1])
 
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(result['body'])
+        with open(report_path, 'w', encoding='utf-8') as report_file:
+            report_file.writelines(iter_html_report(*report_inputs))
 
         print(f"Report saved to: {report_path}")
         print("You can now open the HTML file in your browser!")
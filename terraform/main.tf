@@ -262,6 +262,7 @@ resource "aws_iam_role_policy" "ecs_task_policy" {
           "s3:GetObject",
           "s3:ListBucket",
           "s3:PutObject",
+          "s3:DeleteObject",
           "s3:GetBucketLocation"
         ]
         Resource = [
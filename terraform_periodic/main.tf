@@ -171,6 +171,7 @@ resource "aws_iam_role_policy" "ecs_task_policy" {
           "s3:GetObject",
           "s3:ListBucket",
           "s3:PutObject",
+          "s3:DeleteObject",
           "s3:GetBucketLocation"
         ]
         Resource = [
@@ -342,7 +343,9 @@ resource "aws_iam_role_policy" "lambda_data_access" {
           "athena:GetQueryExecution",
           "athena:GetQueryResults",
           "athena:StopQueryExecution",
-          "athena:GetWorkGroup"
+          "athena:GetWorkGroup",
+          "athena:ListQueryExecutions",
+          "athena:BatchGetQueryExecution"
         ]
         Resource = "*"
       },